@@ -1,3 +1,4 @@
-from .messageType import MESSAGE_TYPE, MODEL_STATUS
+from .messageType import MESSAGE_TYPE, MODEL_STATUS, PRIORITY
 from .server import Server
-from .client import Client,Trigger, EventHandler
\ No newline at end of file
+from .client import Client,Trigger, EventHandler
+from .loopback import LoopbackBus, LoopbackClient
\ No newline at end of file
@@ -0,0 +1,183 @@
+import threading
+from uuid import uuid4
+from collections import OrderedDict
+
+from .messageType import MESSAGE_TYPE
+
+"""
+Classes to aggregate the messages sent to a room on the server before they are sent to the
+room's clients
+"""
+
+reduce_operations = {
+    'sum': sum,
+    'mean': lambda values: sum(values) / len(values),
+    'max': max,
+    'min': min,
+}
+
+# Number of reduced groups per room to remember, so late contributions to them are dropped
+DEFAULT_COMPLETED_SIZE = 1024
+
+
+def same_shape(value, other):
+    """
+    Check if the given values can be reduced together, i.e. if they are numbers or lists and
+    dictionaries of numbers with the same lengths and keys.
+
+    :param value: The first value.
+    :param other: The second value.
+    :return: True if the values have the same shape, False otherwise.
+    """
+    if isinstance(value, dict):
+        return isinstance(other, dict) and value.keys() == other.keys() and all(same_shape(value[k], other[k]) for k in value)
+    if isinstance(value, list):
+        return isinstance(other, list) and len(value) == len(other) and all(same_shape(v, o) for v, o in zip(value, other))
+    return all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in [value, other])
+
+
+def reduce_values(values, operation):
+    """
+    Reduce the given values elementwise with the given operation. Lists and dictionaries are
+    reduced per element, so nested arrays of the same shape are combined into one array.
+
+    :param values: The list of values to reduce.
+    :param operation: The function to reduce a list of numbers to one number.
+    :return: The reduced value.
+    """
+    first = values[0]
+    if isinstance(first, dict):
+        return {k: reduce_values([v[k] for v in values], operation) for k in first}
+    if isinstance(first, list):
+        return [reduce_values(list(v), operation) for v in zip(*values)]
+    return operation(values)
+
+
+class AggregationRoom:
+    """
+    This class collects the contributions to a room grouped by a message field and reduces
+    them to one message once the expected number of contributions has arrived or the timeout
+    has passed.
+
+    :param room: The name of the room.
+    :param expected: The number of contributions to collect before they are reduced.
+    :param callback: The function to call with the room and the reduced message when a group
+                     has been reduced by the timeout.
+    :param operation: The name of the reduce operation ('sum', 'mean', 'max' or 'min') or a
+                      function reducing a list of numbers to one number.
+    :param types: A list of message types which are aggregated. Other messages are sent to the
+                  room as usual.
+    :param field: The message field which is reduced.
+    :param group_by: The message field used to group the contributions, e.g. 'ROOT_ID' or a step id.
+    :param timeout: The number of seconds after the first contribution of a group after which
+                    the group is reduced with the contributions received so far. If not
+                    specified, the group waits for the expected number of contributions.
+    :param completed_size: The number of reduced groups to remember. Contributions to a
+                           remembered group arriving after it was reduced are dropped.
+
+    :ivar groups: The collected contributions by group.
+    :ivar completed: The most recently reduced groups.
+    """
+    def __init__(self, room, expected, callback, operation='sum', types=None, field='DATA', group_by='ROOT_ID', timeout=None, completed_size=DEFAULT_COMPLETED_SIZE):
+        self.room = room
+        self.expected = expected
+        self.callback = callback
+        self.operation = reduce_operations[operation] if isinstance(operation, str) else operation
+        self.types = types if types is not None else [MESSAGE_TYPE.DATA.GRADIENT, MESSAGE_TYPE.DATA.REWARD]
+        self.types = self.types if type(self.types) is list else [self.types]
+        self.field = field
+        self.group_by = group_by
+        self.timeout = timeout
+        self.groups = dict()
+        self.completed_size = completed_size
+        self.completed = OrderedDict()
+        self.lock = threading.Lock()
+
+    def accepts(self, msg_content):
+        """
+        Check if the given message is aggregated by this room.
+
+        :param msg_content: The message to check.
+        :return: True if the message should be aggregated, False otherwise.
+        """
+        return MESSAGE_TYPE.by_id(msg_content["TYPE"]) in self.types and self.field in msg_content
+
+    def add(self, msg_content):
+        """
+        Add the given message to its group. A contribution which can't be reduced with the
+        other contributions of its group is dropped, as is a contribution to a group which has
+        already been reduced. A repeated contribution of the same sender replaces the previous one.
+
+        :param msg_content: The message to add.
+        :return: The reduced message if the group is complete, None otherwise.
+        """
+        group = msg_content.get(self.group_by)
+        with self.lock:
+            if group in self.completed:
+                print(f"[AGGREGATION] {self.room} dropped a late message of {msg_content.get('SENT_BY')}, {self.group_by} {group} has already been reduced.")
+                return None
+            messages = self.groups[group]['messages'] if group in self.groups else dict()
+            reference = next(iter(messages.values()), msg_content)
+            if not same_shape(reference[self.field], msg_content[self.field]):
+                print(f"[AGGREGATION] {self.room} dropped a message of {msg_content.get('SENT_BY')}, {self.field} doesn't match the shape of the group.")
+                return None
+            if group not in self.groups:
+                timer = self.start_timer(group) if self.timeout is not None else None
+                self.groups[group] = {'messages': dict(), 'timer': timer}
+            self.groups[group]['messages'][msg_content.get('SENT_BY')] = msg_content
+            if len(self.groups[group]['messages']) < self.expected:
+                return None
+            return self.reduce(group)
+
+    def start_timer(self, group):
+        """
+        Start a timer which expires the given group once the timeout has passed.
+
+        :param group: The new group.
+        :return: The started timer, or None if the group is expired in another way.
+        """
+        timer = threading.Timer(self.timeout, self.expire, args=(group,))
+        timer.daemon = True
+        timer.start()
+        return timer
+
+    def expire(self, group):
+        """
+        Reduce the given group with the contributions received so far and pass the result to
+        the callback.
+
+        :param group: The group which timed out.
+        """
+        with self.lock:
+            if group not in self.groups:
+                return
+            print(f"[AGGREGATION] {self.room} timed out with {len(self.groups[group]['messages'])}/{self.expected} messages.")
+            msg_content = self.reduce(group)
+        if msg_content is not None:
+            self.callback(self.room, msg_content)
+
+    def reduce(self, group):
+        """
+        Remove the given group and reduce its contributions to one message. The reduced message
+        is based on the first contribution and lists the senders of all contributions.
+
+        :param group: The group to reduce.
+        :return: The reduced message, or None if the reduce operation failed.
+        """
+        state = self.groups.pop(group)
+        self.completed[group] = True
+        while len(self.completed) > self.completed_size:
+            self.completed.popitem(last=False)
+        if state['timer'] is not None:
+            state['timer'].cancel()
+        messages = list(state['messages'].values())
+        msg_content = dict(messages[0])
+        msg_content['ID'] = uuid4().hex
+        try:
+            msg_content[self.field] = reduce_values([m[self.field] for m in messages], self.operation)
+        except Exception as e:
+            print(f"[AGGREGATION] {self.room} failed to reduce {len(messages)} messages: {e}")
+            return None
+        msg_content['SENT_BY'] = self.room
+        msg_content['CONTRIBUTORS'] = [m.get('SENT_BY') for m in messages]
+        return msg_content
@@ -1,9 +1,13 @@
 import socket
+import threading
+import queue
 import json
 import uuid
 import copy
 import inspect
 from .messageType import MESSAGE_TYPE
+from .stream import StreamSender, StreamReceiver, DEFAULT_STREAM_TIMEOUT
+from .lanes import PriorityLanes, DEFAULT_STARVATION_LIMIT, DEFAULT_INBOUND_LIMIT
 
 """
 Class for client to connect to server, send and receive messages
@@ -21,6 +25,20 @@ class Client:
     :param port: The port number of the server.
     :param format: The encoding format to use for messages.
     :param header_length: The length of the message header in bytes.
+    :param stream_chunk_size: If specified, messages with a stream field (e.g. model weights)
+                              are sent as a stream of chunks of this size in bytes.
+    :param stream_delta: If True, streamed dictionaries only contain the entries which changed
+                         since the last stream to the same recipients.
+    :param stream_dir: A directory to write incoming streams to instead of memory.
+    :param stream_cache_size: The number of sent streams to keep to answer resume requests.
+                              Only references to the streamed fields are kept, so they must
+                              not be modified while they can still be resumed.
+    :param stream_timeout: The number of seconds without a new chunk after which an incomplete
+                           incoming stream is dropped, or None to keep incomplete streams.
+    :param starvation_limit: The number of times a received lower priority message can be
+                             passed over before it is handled.
+    :param inbound_limit: The number of received messages to queue before normal and low
+                          priority messages wait to be read from the socket, or None for no limit.
     :param kwargs: Additional keyword arguments that will be passed to event handler
                    functions when they are called.
 
@@ -29,14 +47,18 @@ class Client:
     :ivar port: The port number of the server.
     :ivar format: The encoding format to use for messages.
     :ivar header_length: The length of the message header in bytes.
-    :ivar eventHandlers: A set of `EventHandler` instances registered with this client.
+    :ivar eventHandlers: A list of `EventHandler` instances registered with this client, in
+                         the order they are called.
     :ivar rooms: A set of rooms that the client has joined.
     :ivar kwargs: Additional keyword arguments that will be passed to event handler
                   functions when they are called.
     :ivar client: The socket used to connect to the server.
+    :ivar stream_sender: The `StreamSender` used to split outgoing streams, or None if
+                         streaming is disabled.
+    :ivar stream_receiver: The `StreamReceiver` used to reassemble incoming streams.
     """
 
-    def __init__(self,name, server, port, format='utf-8', header_length=10, **kwargs):
+    def __init__(self,name, server, port, format='utf-8', header_length=10, stream_chunk_size=None, stream_delta=False, stream_dir=None, stream_cache_size=0, stream_timeout=DEFAULT_STREAM_TIMEOUT, starvation_limit=DEFAULT_STARVATION_LIMIT, inbound_limit=DEFAULT_INBOUND_LIMIT, **kwargs):
         """
         Initialize a new `Client` instance with the given parameters.
 
@@ -45,6 +67,17 @@ class Client:
         :param port: The port number of the server.
         :param format: The encoding format to use for messages.
         :param header_length: The length of the message header in bytes.
+        :param stream_chunk_size: If specified, messages with a stream field are sent as a
+                                  stream of chunks of this size in bytes.
+        :param stream_delta: If True, streamed dictionaries only contain the changed entries.
+        :param stream_dir: A directory to write incoming streams to instead of memory.
+        :param stream_cache_size: The number of sent streams to keep to answer resume requests.
+        :param stream_timeout: The number of seconds without a new chunk after which an
+                               incomplete incoming stream is dropped.
+        :param starvation_limit: The number of times a received lower priority message can
+                                 be passed over before it is handled.
+        :param inbound_limit: The number of received messages to queue before normal and low
+                              priority messages wait to be read from the socket.
         :param kwargs: Additional keyword arguments that will be passed to event handler
                        functions when they are called.
         """
@@ -53,9 +86,16 @@ class Client:
         self.port = port
         self.format = format
         self.header_length = header_length
-        self.eventHandlers = set()
+        self.eventHandlers = []
         self.rooms = set()
         self.kwargs = kwargs
+        self.starvation_limit = starvation_limit
+        self.inbound_limit = inbound_limit
+        self.stream_sender = StreamSender(name, stream_chunk_size, format, stream_delta, stream_cache_size) if stream_chunk_size is not None else None
+        self.stream_receiver = StreamReceiver(format, stream_dir, stream_timeout)
+        self.stream_queue = queue.Queue()
+        self.stream_writer = None
+        self.send_lock = threading.Lock()
 
         self.client = self.connect(self.server, self.port)
         self.register()
@@ -83,13 +123,54 @@ class Client:
 
     def send(self, message):
         """
-        Send the given message to the server.
+        Send the given message to the server. If streaming is enabled and the message has a
+        stream field, it is sent as a stream of chunks in the background instead, so other
+        messages can be sent in between the chunks. The stream field must not be modified
+        until the stream has been sent.
+
+        :param message: The message to send.
+        """
+        if self.stream_sender is not None and self.stream_sender.is_streamable(message):
+            self.queue_stream(self.stream_sender.stream(message))
+            return
+        self.transmit(message)
+
+    def queue_stream(self, messages):
+        """
+        Queue the given stream messages to be sent by the stream writer thread. Streams are
+        sent one after another in the order they were queued.
+
+        :param messages: An iterable of the manifest and chunk messages of a stream.
+        """
+        if self.stream_writer is None:
+            self.stream_writer = threading.Thread(target=self.write_streams, daemon=True)
+            self.stream_writer.start()
+        self.stream_queue.put(messages)
+
+    def write_streams(self):
+        """
+        Send the queued streams one message at a time until the connection is closed.
+        """
+        while True:
+            messages = self.stream_queue.get()
+            try:
+                for message in messages:
+                    self.transmit(message)
+            except OSError:
+                print(f"[STREAM] {self.name} stopped sending a stream, the connection is closed.")
+            finally:
+                self.stream_queue.task_done()
+
+    def transmit(self, message):
+        """
+        Serialize the given message and write it to the socket.
 
         :param message: The message to send.
         """
         message_encoded = json.dumps(message).encode(self.format)
-        self.client.send(f"{len(message_encoded):<{self.header_length}}".encode(self.format))
-        self.client.send(message_encoded)
+        with self.send_lock:
+            self.client.sendall(f"{len(message_encoded):<{self.header_length}}".encode(self.format))
+            self.client.sendall(message_encoded)
 
     def receive(self):
         """
@@ -102,30 +183,26 @@ class Client:
             if not len(message_header):
                 return False
             message_length = int(message_header.decode(self.format))
-            full_message_received = False
-            message = b''
-            message_length_left = message_length
-            while not full_message_received:
-                message += self.client.recv(message_length_left)
-                message_length_left = message_length - len(message)
-                if message_length_left <= 0:
-                    full_message_received = True
-           
-            message = message.decode(self.format)
-            if message_length !=  len(message.encode(self.format)):
-                print(message)
-
-
-            return json.loads(message)
+            message = bytearray(message_length)
+            view = memoryview(message)
+            message_length_received = 0
+            while message_length_received < message_length:
+                received = self.client.recv_into(view[message_length_received:])
+                if received == 0:
+                    return False
+                message_length_received += received
+
+            return json.loads(message.decode(self.format))
         except:
             return False
 
 
     def close(self):
         """
-        Close the connection to the server. This will send a DISCONNECT command message
-        to the server and close the socket.
+        Close the connection to the server. This will wait until all queued streams have been
+        sent, send a DISCONNECT command message to the server and close the socket.
         """
+        self.stream_queue.join()
         self.send({'ID':uuid.uuid4().hex ,'TYPE': MESSAGE_TYPE.COMMAND.DISCONNECT.id, 'TO_ROOM':'_command'})
         self.client.close()
 
@@ -154,7 +231,7 @@ class Client:
         if responseRooms is not None:
             for room in responseRooms:
                 self.join_room(room)
-        self.eventHandlers.add(EventHandler(handleFunction, responseType,responseRooms,responseComponent, trigger))
+        self.eventHandlers.append(EventHandler(handleFunction, responseType,responseRooms,responseComponent, trigger))
 
     def join_room(self, room):
         """
@@ -169,21 +246,84 @@ class Client:
     def listen(self):
         """
         Listen for incoming messages from the server and handle them using the registered
-        event handlers. This method will block until the connection to the server is closed.
+        event handlers. Messages are received in a separate thread and handled by priority,
+        so e.g. commands don't wait behind a backlog of data messages. This method will
+        block until the connection to the server is closed.
         """
+        lanes = PriorityLanes(self.starvation_limit, self.inbound_limit)
+        threading.Thread(target=self.read_messages, args=(lanes,), daemon=True).start()
         while True:
-            message = self.receive()
-            if message is not False:
-                for eventHandler in self.eventHandlers:
-                    if eventHandler.is_triggered(message):
-                        responses = eventHandler.handle(message,**self.filter_dict(self.kwargs,eventHandler.handleFunction))
-                        if responses is not None:
-                            for response in responses:
-                                self.send(self.add_propagated_fields(message,response))
+            message = lanes.get()
+            if message is not None:
+                self.dispatch(message)
             else:
                 self.close()
                 break
 
+    def read_messages(self, lanes):
+        """
+        Receive messages from the server and queue them in the lane of their priority until
+        the connection is closed.
+
+        :param lanes: The `PriorityLanes` to queue the messages in.
+        """
+        try:
+            while True:
+                message = self.receive()
+                if message is False:
+                    break
+                lanes.put(message, MESSAGE_TYPE.priority(message))
+        finally:
+            lanes.close()
+
+    def dispatch(self, message):
+        """
+        Dispatch the given incoming message. Stream messages are passed to the stream
+        receiver and sender, all other messages to the event handlers.
+
+        :param message: The received message.
+        """
+        msg_type = MESSAGE_TYPE.by_id(message['TYPE'])
+        if msg_type == MESSAGE_TYPE.STREAM.MANIFEST:
+            if not self.stream_receiver.add_manifest(message):
+                self.send({'ID':uuid.uuid4().hex ,'TYPE': MESSAGE_TYPE.STREAM.RESUME.id, 'STREAM_ID': message['STREAM_ID'], 'MISSING': [], 'FULL': True, 'SNAPSHOT': message.get('SNAPSHOT'), 'TO': message['SENT_BY']})
+            elif not self.stream_receiver.missing(message['STREAM_ID']):
+                self.handle_message(self.stream_receiver.complete(message['STREAM_ID']))
+        elif msg_type == MESSAGE_TYPE.STREAM.CHUNK:
+            message = self.stream_receiver.add_chunk(message)
+            if message is not None:
+                self.handle_message(message)
+        elif msg_type == MESSAGE_TYPE.STREAM.RESUME:
+            if self.stream_sender is not None:
+                self.queue_stream(self.stream_sender.resume(message))
+        else:
+            self.handle_message(message)
+
+    def handle_message(self, message):
+        """
+        Handle the given message using the registered event handlers and send their responses.
+
+        :param message: The message to handle.
+        """
+        for eventHandler in self.eventHandlers:
+            if eventHandler.is_triggered(message):
+                responses = eventHandler.handle(message,**self.filter_dict(self.kwargs,eventHandler.handleFunction))
+                if responses is not None:
+                    for response in responses:
+                        self.send(self.add_propagated_fields(message,response))
+
+    def resume_streams(self):
+        """
+        Request the missing chunks of all incomplete incoming streams from their senders. This
+        will send a RESUME message directly to the sender of each stream.
+        """
+        for stream_id, state in list(self.stream_receiver.streams.items()):
+            missing = self.stream_receiver.missing(stream_id)
+            if not missing:
+                self.handle_message(self.stream_receiver.complete(stream_id))
+            elif 'SENT_BY' in state['manifest']:
+                self.send({'ID':uuid.uuid4().hex ,'TYPE': MESSAGE_TYPE.STREAM.RESUME.id, 'STREAM_ID': stream_id, 'MISSING': missing, 'TO': state['manifest']['SENT_BY']})
+
 
     def add_propagated_fields(self, message, response):
         """
@@ -336,7 +476,7 @@ class Trigger:
                  otherwise.
         """
         if MESSAGE_TYPE.by_id(message['TYPE']) in self.types:
-            if self.rooms is not None and message['TO_ROOM'] in self.rooms:
+            if self.rooms is not None and message.get('TO_ROOM') in self.rooms:
                 return True
             if self.directmessage and 'TO_ROOM' not in message.keys():
                 return True
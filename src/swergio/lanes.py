@@ -0,0 +1,113 @@
+import threading
+from collections import deque
+
+from .messageType import PRIORITY
+
+"""
+Class for a queue with one lane per message priority
+"""
+
+DEFAULT_STARVATION_LIMIT = 16
+# Size limit of the server's outbound queue of each client, in bytes
+DEFAULT_OUTBOUND_LIMIT = 64 * 1024 * 1024
+# Size limit of the client's inbound queue, in messages
+DEFAULT_INBOUND_LIMIT = 64
+
+class PriorityLanes:
+    """
+    This class defines a thread safe queue with one FIFO lane per priority. Items are taken
+    from the lane with the highest priority first. To prevent starvation, a lane which has
+    been passed over `starvation_limit` times while holding items is served next.
+
+    If a size limit is given, adding an item blocks while the queue is full, which passes
+    backpressure on to the producer. High priority items have a separate, higher limit, so
+    they can still be added while lower priority items fill the queue. An item larger than
+    the limit is added once the queue is empty.
+
+    :param starvation_limit: The number of times a non empty lane can be passed over before
+                             it is served.
+    :param max_size: The maximum total size of the queued items, or None for no limit.
+    :param high_max_size: The maximum total size of the queued items when adding a high
+                          priority item. Defaults to twice `max_size`.
+
+    :ivar lanes: The list of lanes, ordered from the highest to the lowest priority.
+    :ivar skipped: The number of times each lane has been passed over.
+    :ivar size: The total size of the queued items.
+    :ivar closed: True if no more items will be added to the queue.
+    """
+    def __init__(self, starvation_limit=DEFAULT_STARVATION_LIMIT, max_size=None, high_max_size=None):
+        self.starvation_limit = starvation_limit
+        self.max_size = max_size
+        self.high_max_size = high_max_size if high_max_size is not None or max_size is None else 2 * max_size
+        self.size = 0
+        self.lanes = [deque() for _ in PRIORITY.all()]
+        self.skipped = [0 for _ in self.lanes]
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def put(self, item, priority=PRIORITY.NORMAL, size=1):
+        """
+        Add the given item to the lane of the given priority, waiting while the queue is full.
+
+        :param item: The item to add.
+        :param priority: The priority of the item. Items with an unknown priority are added to
+                         the normal priority lane.
+        :param size: The size of the item counted against the size limit.
+        :return: False if the queue is closed and the item was dropped, True otherwise.
+        """
+        if type(priority) is not int or priority not in PRIORITY.all():
+            priority = PRIORITY.NORMAL
+        with self.condition:
+            while self.is_full(priority, size) and not self.closed:
+                self.condition.wait()
+            if self.closed:
+                return False
+            self.lanes[priority].append((item, size))
+            self.size += size
+            self.condition.notify_all()
+            return True
+
+    def is_full(self, priority, size):
+        """
+        Check if an item of the given priority and size has to wait for space in the queue.
+        """
+        max_size = self.high_max_size if priority == PRIORITY.HIGH else self.max_size
+        if max_size is None or self.size == 0:
+            return False
+        return self.size + size > max_size
+
+    def get(self):
+        """
+        Remove and return the next item, waiting until an item is available.
+
+        :return: The next item, or None if the queue is closed and empty.
+        """
+        with self.condition:
+            while not any(self.lanes) and not self.closed:
+                self.condition.wait()
+            if not any(self.lanes):
+                return None
+            chosen = None
+            for priority, lane in enumerate(self.lanes):
+                if lane and self.skipped[priority] >= self.starvation_limit:
+                    chosen = priority
+                    break
+            if chosen is None:
+                chosen = next(priority for priority, lane in enumerate(self.lanes) if lane)
+            for priority, lane in enumerate(self.lanes):
+                if lane and priority != chosen:
+                    self.skipped[priority] += 1
+            self.skipped[chosen] = 0
+            item, size = self.lanes[chosen].popleft()
+            self.size -= size
+            self.condition.notify_all()
+            return item
+
+    def close(self):
+        """
+        Close the queue. Remaining items can still be taken, after that `get` returns None.
+        Items added after closing are dropped.
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
@@ -0,0 +1,306 @@
+import copy
+from collections import deque
+
+from .server import Server
+from .client import Client
+from .aggregation import AggregationRoom
+
+"""
+Classes to run the server routing and several clients in one process, passing messages as
+Python objects through memory queues instead of sockets. Every recipient gets its own deep
+copy of a message, so clients are isolated from each other like with sockets
+"""
+
+
+class LoopbackConnection:
+    """
+    This class represents the connection of a `LoopbackClient` on the `LoopbackServer`. It
+    takes the place of the client socket in the server's rooms. Connections are hashed by
+    their index, so the server iterates over them in the order they were created.
+
+    :param bus: The `LoopbackBus` the connection belongs to.
+    :param client: The `LoopbackClient` of the connection.
+    :param index: The position of the connection on the bus.
+    """
+    def __init__(self, bus, client, index):
+        self.bus = bus
+        self.client = client
+        self.index = index
+
+    def __hash__(self):
+        return self.index
+
+    def close(self):
+        """
+        Remove the connection from the server.
+        """
+        self.bus.server.remove_client(self)
+
+
+class LoopbackAggregationRoom(AggregationRoom):
+    """
+    This class aggregates the messages sent to a room like `AggregationRoom`, but measures
+    the timeout in messages delivered by a `LoopbackBus` instead of seconds, so groups expire
+    deterministically without timer threads.
+
+    :param bus: The `LoopbackBus` delivering the messages.
+    :param args: Positional arguments which are passed to `AggregationRoom`.
+    :param kwargs: Keyword arguments which are passed to `AggregationRoom`.
+
+    :ivar deadlines: The number of delivered messages after which each group expires.
+    """
+    def __init__(self, bus, *args, **kwargs):
+        self.bus = bus
+        self.deadlines = dict()
+        super().__init__(*args, **kwargs)
+
+    def start_timer(self, group):
+        """
+        Expire the given group once the bus has delivered `timeout` more messages.
+
+        :param group: The new group.
+        :return: None, the group is expired by `expire_due`.
+        """
+        self.deadlines[group] = self.bus.steps + self.timeout
+        return None
+
+    def expire_due(self, drained=False):
+        """
+        Expire the groups whose deadline has passed.
+
+        :param drained: If True, all groups with a deadline are expired, because no message
+                        which could complete them is left on the bus.
+        :return: True if a group was expired, False otherwise.
+        """
+        due = [g for g, deadline in self.deadlines.items() if drained or deadline <= self.bus.steps]
+        for group in due:
+            del self.deadlines[group]
+            self.expire(group)
+        return len(due) > 0
+
+
+class LoopbackServer(Server):
+    """
+    This class routes messages like `Server`, but puts them on the queue of a `LoopbackBus`
+    instead of writing them to sockets. The copy of a message made by `LoopbackClient.transmit`
+    is handed to its first recipient, further recipients get their own deep copy.
+
+    :param bus: The `LoopbackBus` to deliver the messages to.
+    :param enable_logging: Flag to enable logging of the messages.
+
+    :ivar handoff: The message being broadcast if it can be handed to a recipient without a copy.
+    """
+    def __init__(self, bus, enable_logging=True):
+        self.bus = bus
+        self.handoff = None
+        super().__init__(None, None, 'utf-8', 10, enable_logging)
+
+    def create_socket(self):
+        """
+        The loopback server doesn't use a socket.
+        """
+        return None
+
+    def add_aggregation_room(self, room, expected, operation='sum', types=None, field='DATA', group_by='ROOT_ID', timeout=None):
+        """
+        Aggregates the messages sent to the given room like `Server.add_aggregation_room`. The
+        timeout is the number of messages the bus delivers after the first contribution of a
+        group, and groups which are still waiting when the bus runs out of messages are
+        reduced right away.
+
+        :param room: Name of the room
+        :type room: str
+        :param expected: Number of contributions to collect before they are reduced
+        :type expected: int
+        :param operation: Reduce operation ('sum', 'mean', 'max' or 'min') or function reducing a list of numbers
+        :type operation: str or callable
+        :param types: Message types which are aggregated, defaults to DATA/GRADIENT and DATA/REWARD
+        :type types: list
+        :param field: Message field which is reduced
+        :type field: str
+        :param group_by: Message field used to group the contributions
+        :type group_by: str
+        :param timeout: Delivered messages after the first contribution of a group after which it is reduced anyway
+        :type timeout: int
+        """
+        with self.clients_lock:
+            if room not in self.rooms:
+                self.rooms[room] = set()
+                print(f"[ROOM CREATED] {room}")
+            self.aggregation_rooms[room] = LoopbackAggregationRoom(self.bus, room, expected, self.send_aggregated_message, operation, types, field, group_by, timeout)
+        print(f"[AGGREGATION] {room} aggregates {expected} messages per {group_by}.")
+
+    def expire_aggregations(self, drained=False):
+        """
+        Expire the aggregation groups whose timeout has passed.
+        :param drained: Flag to expire all groups with a timeout, because the bus is empty
+        :type drained: bool
+        :return: True if a group was expired, False otherwise
+        :rtype: bool
+        """
+        expired = [room.expire_due(drained) for room in list(self.aggregation_rooms.values())]
+        return any(expired)
+
+    def broadcast_message(self, client, message_header, message, msg_content):
+        """
+        Broadcasts the given message like `Server.broadcast_message`. Unless the message is kept
+        by an aggregation room, its first recipient gets it without a copy.
+        :param client: Loopback connection who sent the message
+        :type client: LoopbackConnection
+        :param message_header: Ignored, messages are not serialized
+        :type message_header: bytes
+        :param message: Ignored, messages are not serialized
+        :type message: str
+        :param msg_content: Message content containing the recipient details
+        :type msg_content: dict
+        """
+        aggregation_room = self.aggregation_rooms.get(msg_content.get("TO_ROOM"))
+        if aggregation_room is None or not aggregation_room.accepts(msg_content):
+            self.handoff = msg_content
+        try:
+            super().broadcast_message(client, message_header, message, msg_content)
+        finally:
+            self.handoff = None
+
+    def send_to_clients(self, clients, msg_content, message=None):
+        """
+        Puts the given message on the bus queue for each of the given clients. The message
+        being broadcast is handed to the first client, the other clients get a deep copy.
+        :param clients: Loopback connections to send the message to
+        :type clients: list
+        :param msg_content: Message content to be sent
+        :type msg_content: dict
+        :param message: Ignored, messages are not serialized
+        :type message: str
+        """
+        for other in clients:
+            if msg_content is self.handoff:
+                self.handoff = None
+                self.bus.queue.append((other, msg_content))
+            else:
+                self.bus.queue.append((other, copy.deepcopy(msg_content)))
+
+    def start(self):
+        """
+        The loopback server doesn't accept connections, clients connect via the bus.
+        """
+        raise RuntimeError("Use LoopbackBus.run() to process the messages of a loopback server.")
+
+
+class LoopbackBus:
+    """
+    This class connects a `LoopbackServer` with several `LoopbackClient` instances in one
+    process. Messages are delivered in the order they were sent by calling `run`, so the
+    event handlers of all clients are called deterministically in one thread. Aggregation
+    timeouts are counted in delivered messages, see `LoopbackServer.add_aggregation_room`.
+
+    :param enable_logging: Flag to enable logging of the messages on the server.
+
+    :ivar server: The `LoopbackServer` routing the messages.
+    :ivar queue: The queue of connections and messages waiting to be delivered.
+    :ivar connections: The connections of all clients in the order they connected.
+    :ivar steps: The total number of delivered messages.
+    """
+    def __init__(self, enable_logging=True):
+        self.queue = deque()
+        self.connections = []
+        self.steps = 0
+        self.server = LoopbackServer(self, enable_logging)
+
+    def connect(self, client):
+        """
+        Connect the given client to the server.
+
+        :param client: The `LoopbackClient` to connect.
+        :return: The connection of the client.
+        """
+        connection = LoopbackConnection(self, client, len(self.connections))
+        self.connections.append(connection)
+        with self.server.clients_lock:
+            self.server.clients.add(connection)
+        return connection
+
+    def run(self, max_steps=None):
+        """
+        Deliver the queued messages to their clients until the queue is empty. Messages sent
+        by event handlers are added to the end of the queue and delivered in the same run.
+        Aggregation groups which are still waiting when the queue is empty are reduced, and
+        the reduced messages are delivered in the same run.
+
+        :param max_steps: The maximum number of messages to deliver. If not specified, messages
+                          are delivered until the queue is empty.
+        :return: The number of delivered messages.
+        """
+        steps = 0
+        while max_steps is None or steps < max_steps:
+            if not self.queue:
+                if not self.server.expire_aggregations(drained=True):
+                    break
+                continue
+            connection, message = self.queue.popleft()
+            steps += 1
+            self.steps += 1
+            if connection in self.server.clients:
+                connection.client.dispatch(message)
+            self.server.expire_aggregations()
+        return steps
+
+
+class LoopbackClient(Client):
+    """
+    This class defines a client connected to a `LoopbackBus`. It is used like `Client`, but
+    messages are passed to the server as Python objects without serialization.
+
+    :param name: The name of the client.
+    :param bus: The `LoopbackBus` to connect to.
+    :param kwargs: Additional keyword arguments which are passed to `Client`.
+
+    :ivar bus: The `LoopbackBus` the client is connected to.
+    """
+    def __init__(self, name, bus, **kwargs):
+        self.bus = bus
+        super().__init__(name, None, None, **kwargs)
+
+    def connect(self, server, port):
+        """
+        Connect to the server of the bus.
+
+        :param server: Ignored.
+        :param port: Ignored.
+        :return: The `LoopbackConnection` of the client.
+        """
+        return self.bus.connect(self)
+
+    def transmit(self, message):
+        """
+        Pass a deep copy of the given message to the server of the bus, so later changes of the
+        sender don't affect the recipients. This copy is handed to the first recipient.
+
+        :param message: The message to send.
+        """
+        self.bus.server.route_message(self.client, copy.deepcopy(message))
+
+    def queue_stream(self, messages):
+        """
+        Pass the given stream messages to the server right away, so streams are delivered
+        deterministically.
+
+        :param messages: An iterable of the manifest and chunk messages of a stream.
+        """
+        for message in messages:
+            self.transmit(message)
+
+    def receive(self):
+        """
+        Messages are delivered by the bus, use `listen` or `LoopbackBus.run` instead.
+
+        :return: False
+        """
+        return False
+
+    def listen(self):
+        """
+        Deliver all queued messages on the bus, including the ones for other clients, until
+        no messages are left.
+        """
+        self.bus.run()
@@ -32,6 +32,25 @@ class MODEL_STATUS:
                 return v
         return None
 
+class PRIORITY:
+    """
+    This class contains the possible priorities of a message. Messages with a higher priority
+    (lower value) are handled before messages with a lower priority.
+    """
+    HIGH = 0
+    NORMAL = 1
+    LOW = 2
+
+    @staticmethod
+    def all():
+        """
+        Returns all priorities, ordered from the highest to the lowest priority.
+
+        :return: The list of priorities.
+        :rtype: list
+        """
+        return [PRIORITY.HIGH, PRIORITY.NORMAL, PRIORITY.LOW]
+
 class MessageTypeSetting:
     """
     This class represents a setting for a message type.
@@ -40,12 +59,18 @@ class MessageTypeSetting:
     :param name: The name of the message type setting.
     :param required_fields: A list of field names that are required for a message of this type.
     :param optional_fields: A list of field names that are optional for a message of this type.
+    :param stream_field: The name of a potentially large field (e.g. model weights) that can be
+                         sent as a chunked stream instead of a single message.
+    :param priority: The priority of messages of this type. If not specified, the priority of
+                     the main type is used.
     """
-    def __init__(self, id, name, required_fields, optional_fields):
+    def __init__(self, id, name, required_fields, optional_fields, stream_field=None, priority=None):
         self.id = id
         self.name = name
         self.required_fields = required_fields
         self.optional_fields = optional_fields
+        self.stream_field = stream_field
+        self.priority = priority
 
     def check_fields(self, msg_content):
         """
@@ -61,6 +86,8 @@ class MessageTypeSetting:
         return True
 
 class MessageMainType:
+    priority = PRIORITY.NORMAL
+
     @staticmethod
     def by_id(id, cls):
         """
@@ -81,6 +108,7 @@ class DATA(MessageMainType):
     """
     This class contains the possible settings for a DATA message.
     """
+    priority = PRIORITY.NORMAL
     FORWARD = MessageTypeSetting('DATA/FORWARD','FORWARD',['DATA'],['ROOM'])
     GRADIENT = MessageTypeSetting('DATA/GRADIENT','GRADIENT',['DATA'],['ROOM'])
     REWARD = MessageTypeSetting('DATA/REWARD','REWARD',['DATA'],['ROOM'])
@@ -91,28 +119,40 @@ class COMMAND(MessageMainType):
     """
     This class contains the possible settings for a COMMAND message.
     """
+    priority = PRIORITY.HIGH
     REGISTER = MessageTypeSetting('COMMAND/REGISTER','REGISTER',['NAME'],[])
     DISCONNECT = MessageTypeSetting('COMMAND/DISCONNECT','DISCONNECT',[],[])
     JOINROOM = MessageTypeSetting('COMMAND/JOINROOM','JOINROOM',['ROOM'],[])
     LEAVEROOM = MessageTypeSetting('COMMAND/LEAVEROOM','LEAVEROOM',['ROOM'],[])
     ENABLELOGGING = MessageTypeSetting('COMMAND/ENABLELOGGING','ENABLELOGGING',[],['COMPONENT'])
     DISABLELOGGING = MessageTypeSetting('COMMAND/DISABLELOGGING','DISABLELOGGING',[],['COMPONENT'])
-    SAVEMODELWEIGHTS = MessageTypeSetting('COMMAND/SAVEMODELWEIGHTS','SAVEMODELWEIGHTS',[],['WEIGHTS','COMPONENT'])
-    LOADMODELWEIGHTS = MessageTypeSetting('COMMAND/LOADMODELWEIGHTS','LOADMODELWEIGHTS',[],['WEIGHTS','COMPONENT'])
-    SAVESETTINGS = MessageTypeSetting('COMMAND/SAVESETTINGS','SAVESETTINGS',['SETTINGS'],['COMPONENT'])
-    LOADSETTINGS = MessageTypeSetting('COMMAND/LOADSETTINGS','LOADSETTINGS',['SETTINGS'],['COMPONENT'])
+    SAVEMODELWEIGHTS = MessageTypeSetting('COMMAND/SAVEMODELWEIGHTS','SAVEMODELWEIGHTS',[],['WEIGHTS','COMPONENT'],'WEIGHTS',PRIORITY.NORMAL)
+    LOADMODELWEIGHTS = MessageTypeSetting('COMMAND/LOADMODELWEIGHTS','LOADMODELWEIGHTS',[],['WEIGHTS','COMPONENT'],'WEIGHTS',PRIORITY.NORMAL)
+    SAVESETTINGS = MessageTypeSetting('COMMAND/SAVESETTINGS','SAVESETTINGS',['SETTINGS'],['COMPONENT'],'SETTINGS',PRIORITY.NORMAL)
+    LOADSETTINGS = MessageTypeSetting('COMMAND/LOADSETTINGS','LOADSETTINGS',['SETTINGS'],['COMPONENT'],'SETTINGS',PRIORITY.NORMAL)
     CUSTOM = MessageTypeSetting('COMMAND/CUSTOM','CUSTOM',[],[])
 
 class LOG(MessageMainType):
     """
     This class contains the possible settings for a LOG message.
     """
-    MODELWEIGHTS = MessageTypeSetting('LOG/MODELWEIGHTS','MODELWEIGHTS',['WEIGHTS', 'COMPONENT'],['DM'])
-    SETTINGS = MessageTypeSetting('LOG/SETTINGS','SETTINGS',['SETTINGS', 'COMPONENT'],['DM'])
+    priority = PRIORITY.LOW
+    MODELWEIGHTS = MessageTypeSetting('LOG/MODELWEIGHTS','MODELWEIGHTS',['WEIGHTS', 'COMPONENT'],['DM'],'WEIGHTS')
+    SETTINGS = MessageTypeSetting('LOG/SETTINGS','SETTINGS',['SETTINGS', 'COMPONENT'],['DM'],'SETTINGS')
     MESSAGE = MessageTypeSetting('LOG/MESSAGES','MESSAGES',['MESSAGE', 'SENDER', 'ROOM'],[])
     KPI = MessageTypeSetting('LOG/KPI','KPI',['KPI', 'COMPONENT','TIME','VALUE'],[])
     RUN = MessageTypeSetting('LOG/RUN','RUN',['RUN'],['TYPE','STARTTIME','ENDTIME'])
     CUSTOM = MessageTypeSetting('LOG/CUSTOM','CUSTOM',[],[])
+
+class STREAM(MessageMainType):
+    """
+    This class contains the possible settings for a STREAM message, used to transfer a large
+    message field in chunks.
+    """
+    priority = PRIORITY.LOW
+    MANIFEST = MessageTypeSetting('STREAM/MANIFEST','MANIFEST',['STREAM_ID','STREAM_TYPE','FIELD','SIZE','SIZES','CHUNK_SIZE','CHECKSUMS'],['KEYS','SNAPSHOT','BASE','ALL_KEYS','STREAM_ROOM'])
+    CHUNK = MessageTypeSetting('STREAM/CHUNK','CHUNK',['STREAM_ID','INDEX','CHUNK'],[])
+    RESUME = MessageTypeSetting('STREAM/RESUME','RESUME',['STREAM_ID','MISSING'],['FULL','SNAPSHOT'])
     
     
 class MESSAGE_TYPE:
@@ -122,6 +162,7 @@ class MESSAGE_TYPE:
     DATA = DATA
     COMMAND = COMMAND
     LOG = LOG
+    STREAM = STREAM
 
     @staticmethod
     def by_id(id):
@@ -138,3 +179,25 @@ class MESSAGE_TYPE:
                 if messagetype is not None:
                     return messagetype
         return None
+
+    @staticmethod
+    def priority(msg_content):
+        """
+        Returns the priority of the given message. This is the PRIORITY field of the message
+        if it is one of `PRIORITY.all()`, otherwise the priority of the message's type or, if
+        the type doesn't set one, of its main type.
+
+        :param msg_content: A dictionary containing the fields and values for the message.
+        :return: The priority of the message.
+        :rtype: int
+        """
+        priority = msg_content.get('PRIORITY')
+        if type(priority) is int and priority in PRIORITY.all():
+            return priority
+        msg_type = MESSAGE_TYPE.by_id(msg_content.get('TYPE'))
+        if msg_type is not None and msg_type.priority is not None:
+            return msg_type.priority
+        for k,v in MESSAGE_TYPE.__dict__.items():
+            if inspect.isclass(v) and issubclass(v,MessageMainType) and v.by_id(msg_content.get('TYPE'),v) is not None:
+                return v.priority
+        return PRIORITY.NORMAL
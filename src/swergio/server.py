@@ -4,11 +4,13 @@ import json
 from uuid import uuid4
 
 from .messageType import MESSAGE_TYPE
+from .aggregation import AggregationRoom
+from .lanes import PriorityLanes, DEFAULT_STARVATION_LIMIT, DEFAULT_OUTBOUND_LIMIT
 
 reserved_rooms = ['_command','_logging']
 
 class Server:
-    def __init__(self, ip: str, port: int, format: str, header_length: int, enable_logging=True) -> None:
+    def __init__(self, ip: str, port: int, format: str, header_length: int, enable_logging=True, starvation_limit=DEFAULT_STARVATION_LIMIT, outbound_limit=DEFAULT_OUTBOUND_LIMIT) -> None:
         """
         Initializes the server instance with given ip, port, format and header length
 
@@ -22,24 +24,42 @@ class Server:
         :type header_length: int
         :param enable_logging: Flag to enable logging of the messages
         :type enable_logging: bool
+        :param starvation_limit: Number of times a lower priority message can be passed over before it is sent
+        :type starvation_limit: int
+        :param outbound_limit: Size in bytes of the queued messages per client above which normal and low priority messages wait, or None for no limit
+        :type outbound_limit: int
         """
         self.ip = ip
         self.port = port
         self.format = format
         self.header_length = header_length
         self.enable_logging = enable_logging
+        self.starvation_limit = starvation_limit
+        self.outbound_limit = outbound_limit
 
-        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.server.bind((self.ip, self.port))
+        self.server = self.create_socket()
 
         self.clients = set()
         self.rooms = dict()
         for room in reserved_rooms:
             self.rooms[room] = set()
         self.names = dict()
+        self.aggregation_rooms = dict()
+        self.outbound = dict()
         self.clients_lock = threading.Lock()
 
+    def create_socket(self):
+        """
+        Creates the server socket and binds it to the ip and port of the server
+
+        :return: Server socket
+        :rtype: socket.socket
+        """
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind((self.ip, self.port))
+        return server
+
     def handle_client(self, client, addr):
         """
         Handles the incoming client connection and processes the messages
@@ -52,21 +72,22 @@ class Server:
         print(f"[NEW CONNECTION] {addr} connected.")
         try:
             connected = True
-            name = ""
             while connected:
                 message_header = client.recv(self.header_length)
                 if not message_header:
                     break
                 message_length = int(message_header.decode(self.format)) 
 
-                full_message_received = False
-                message = b''
-                message_length_left = message_length
-                while not full_message_received:
-                    message += client.recv(message_length_left)
-                    message_length_left = message_length - len(message)
-                    if message_length_left <= 0:
-                        full_message_received = True
+                message = bytearray(message_length)
+                view = memoryview(message)
+                message_length_received = 0
+                while message_length_received < message_length:
+                    received = client.recv_into(view[message_length_received:])
+                    if received == 0:
+                        break
+                    message_length_received += received
+                if message_length_received < message_length:
+                    break
             
                 message = message.decode(self.format)
 
@@ -76,34 +97,60 @@ class Server:
                     print(message_length)
                     print(message)
 
-                msg_type = MESSAGE_TYPE.by_id(msg_content["TYPE"])
-                
-                if msg_type == MESSAGE_TYPE.COMMAND.DISCONNECT:
-                    connected = self.disconnect_client(client)
-                    break
-
-                if msg_type == MESSAGE_TYPE.COMMAND.REGISTER:
-                    name = self.register_client(client, msg_content)
-                    
-
-                if msg_type == MESSAGE_TYPE.COMMAND.JOINROOM:
-                    self.join_room(client, msg_content)
-                    
-                if msg_type == MESSAGE_TYPE.COMMAND.LEAVEROOM:
-                    self.leave_room(client, msg_content)
-                    
-                self.broadcast_message(client,message_header,message, msg_content)
+                connected = self.route_message(client, msg_content, message_header, message)
 
         finally:
             client.close()
-            with self.clients_lock:
-                self.clients.remove(client)
-                for room in self.rooms:
-                    if client in self.rooms[room]:
-                        self.rooms[room].remove(client)
-                self.names.pop(client)
+            self.remove_client(client)
             print(f"[{addr}] Disconnected.")
 
+    def route_message(self, client, msg_content, message_header=None, message=None):
+        """
+        Processes the commands of the given message and broadcasts it to its recipients
+
+        :param client: Client connection instance who sent the message
+        :type client: socket.socket
+        :param msg_content: Message content
+        :type msg_content: dict
+        :param message_header: Header of the message, if it was received serialized
+        :type message_header: bytes
+        :param message: Message data, if it was received serialized
+        :type message: str
+        :return: False if the client disconnected, True otherwise
+        :rtype: bool
+        """
+        msg_type = MESSAGE_TYPE.by_id(msg_content["TYPE"])
+        
+        if msg_type == MESSAGE_TYPE.COMMAND.DISCONNECT:
+            return self.disconnect_client(client)
+
+        if msg_type == MESSAGE_TYPE.COMMAND.REGISTER:
+            self.register_client(client, msg_content)
+
+        if msg_type == MESSAGE_TYPE.COMMAND.JOINROOM:
+            self.join_room(client, msg_content)
+            
+        if msg_type == MESSAGE_TYPE.COMMAND.LEAVEROOM:
+            self.leave_room(client, msg_content)
+            
+        self.broadcast_message(client,message_header,message, msg_content)
+        return True
+
+    def remove_client(self, client):
+        """
+        Removes the given client from the server and all rooms
+        :param client: Client connection instance
+        :type client: socket.socket
+        """
+        with self.clients_lock:
+            self.clients.remove(client)
+            for room in self.rooms:
+                if client in self.rooms[room]:
+                    self.rooms[room].remove(client)
+            self.names.pop(client)
+            if client in self.outbound:
+                self.outbound.pop(client).close()
+
     def register_client(self,client,msg_content):
         """
         Registers the client with the given name
@@ -162,6 +209,103 @@ class Server:
                 if len(self.rooms[room]) == 0:
                     del self.rooms[room]
 
+    def add_aggregation_room(self, room, expected, operation='sum', types=None, field='DATA', group_by='ROOT_ID', timeout=None):
+        """
+        Aggregates the messages sent to the given room. Contributions are grouped by the
+        `group_by` field until the expected number has arrived or the timeout has passed, and
+        are then reduced to one message which is sent to all clients in the room.
+
+        :param room: Name of the room
+        :type room: str
+        :param expected: Number of contributions to collect before they are reduced
+        :type expected: int
+        :param operation: Reduce operation ('sum', 'mean', 'max' or 'min') or function reducing a list of numbers
+        :type operation: str or callable
+        :param types: Message types which are aggregated, defaults to DATA/GRADIENT and DATA/REWARD
+        :type types: list
+        :param field: Message field which is reduced
+        :type field: str
+        :param group_by: Message field used to group the contributions
+        :type group_by: str
+        :param timeout: Seconds after the first contribution of a group after which it is reduced anyway
+        :type timeout: float
+        """
+        with self.clients_lock:
+            if room not in self.rooms:
+                self.rooms[room] = set()
+                print(f"[ROOM CREATED] {room}")
+            self.aggregation_rooms[room] = AggregationRoom(room, expected, self.send_aggregated_message, operation, types, field, group_by, timeout)
+        print(f"[AGGREGATION] {room} aggregates {expected} messages per {group_by}.")
+
+    def send_aggregated_message(self, room, msg_content):
+        """
+        Sends the given reduced message of an aggregation room to all clients in the room
+        :param room: Name of the aggregation room
+        :type room: str
+        :param msg_content: Reduced message content
+        :type msg_content: dict
+        """
+        self.send_to_room(room, msg_content)
+
+    def send_to_room(self, room, msg_content, sender=None):
+        """
+        Sends the given message to all clients in the given room apart from the sender.
+        The clients lock must not be held by the caller.
+        :param room: Name of the room
+        :type room: str
+        :param msg_content: Message content to be sent
+        :type msg_content: dict
+        :param sender: Client connection instance who sent the message
+        :type sender: socket.socket
+        """
+        with self.clients_lock:
+            clients = [other for other in self.rooms.get(room, set()) if other != sender]
+        self.send_to_clients(clients, msg_content)
+
+    def send_to_clients(self, clients, msg_content, message=None):
+        """
+        Queues the given message for the given clients in the lane of its priority.
+        The message is serialized once for all clients. If the queue of a client is full, this
+        waits until the client has received enough messages, so the clients lock must not be
+        held by the caller.
+        :param clients: Client connection instances to send the message to
+        :type clients: list
+        :param msg_content: Message content to be sent
+        :type msg_content: dict
+        :param message: Serialized message content, if already available
+        :type message: str
+        """
+        if len(clients) == 0:
+            return
+        message = message if message is not None else json.dumps(msg_content)
+        message_encoded = message.encode(self.format)
+        message_header = f"{len(message_encoded):<{self.header_length}}".encode(self.format)
+        priority = MESSAGE_TYPE.priority(msg_content)
+        for other in clients:
+            lanes = self.outbound.get(other)
+            if lanes is not None:
+                lanes.put((message_header, message_encoded), priority, len(message_header) + len(message_encoded))
+
+    def write_client(self, client, lanes):
+        """
+        Sends the queued messages to the given client, higher priority lanes first
+        :param client: Client connection instance
+        :type client: socket.socket
+        :param lanes: Outbound message queue of the client
+        :type lanes: PriorityLanes
+        """
+        while True:
+            message = lanes.get()
+            if message is None:
+                break
+            message_header, message_encoded = message
+            try:
+                client.sendall(message_header)
+                client.sendall(message_encoded)
+            except OSError:
+                lanes.close()
+                break
+
     def broadcast_message(self, client,message_header,message, msg_content):
         """
         Broadcasts the given message to the intended recipients
@@ -177,26 +321,25 @@ class Server:
         print(f"[BROADCAST] {self.names[client]} sent a message.")
         if 'SENT_BY' not in msg_content:
             msg_content['SENT_BY'] = self.names[client]
-            message = json.dumps(msg_content)
-            message_encoded = message.encode(self.format)
-            message_header = f"{len(message_encoded):<{self.header_length}}".encode(self.format)
+            message = None
 
-        with self.clients_lock:
-            if "TO_ROOM" in msg_content:
-                room = msg_content["TO_ROOM"]
-                for other in self.rooms[room]:
-                    if other != client:
-                        other.sendall(message_header)
-                        other.sendall(message.encode(self.format))
-            if "TO" in msg_content:
-                name = msg_content["TO"]
-                for other in self.clients:
-                    if self.names[other] == name:
-                        other.sendall(message_header)
-                        other.sendall(message.encode(self.format))
-            if self.enable_logging:
-                if MESSAGE_TYPE.by_id(msg_content["TYPE"]) in [MESSAGE_TYPE.DATA.FORWARD, MESSAGE_TYPE.DATA.GRADIENT]:
-                    self.send_message_log(msg_content)
+        aggregation_room = self.aggregation_rooms.get(msg_content.get("TO_ROOM"))
+        if aggregation_room is not None and aggregation_room.accepts(msg_content):
+            aggregated = aggregation_room.add(msg_content)
+            if aggregated is not None:
+                self.send_to_room(msg_content["TO_ROOM"], aggregated)
+        elif "TO_ROOM" in msg_content:
+            with self.clients_lock:
+                clients = [other for other in self.rooms[msg_content["TO_ROOM"]] if other != client]
+            self.send_to_clients(clients, msg_content, message)
+        if "TO" in msg_content:
+            name = msg_content["TO"]
+            with self.clients_lock:
+                clients = [other for other in self.clients if self.names.get(other) == name]
+            self.send_to_clients(clients, msg_content, message)
+        if self.enable_logging:
+            if MESSAGE_TYPE.by_id(msg_content["TYPE"]) in [MESSAGE_TYPE.DATA.FORWARD, MESSAGE_TYPE.DATA.GRADIENT]:
+                self.send_message_log(msg_content)
 
     def send_message_log(self, msg_content):
         """
@@ -206,11 +349,7 @@ class Server:
         """
         print(f"[LOGGING] {msg_content['SENT_BY']} sent a message.")
         msg = {'ID': uuid4().hex, 'TO_ROOM': '_logging', 'TYPE': MESSAGE_TYPE.LOG.MESSAGE.id, 'MESSAGE': msg_content}
-        msg = json.dumps(msg)
-        message_encoded = msg.encode(self.format)
-        message_header = f"{len(message_encoded):<{self.header_length}}".encode(self.format)
-        for client in self.rooms['_logging']:
-            client.sendall(message_header + message_encoded)
+        self.send_to_room('_logging', msg)
 
     def start(self):
         """
@@ -220,8 +359,11 @@ class Server:
         self.server.listen()
         while True:
             client, addr = self.server.accept()
+            lanes = PriorityLanes(self.starvation_limit, self.outbound_limit)
             with self.clients_lock:
                 self.clients.add(client)
+                self.outbound[client] = lanes
+            threading.Thread(target=self.write_client, args=(client,lanes), daemon=True).start()
             thread = threading.Thread(target=self.handle_client, args=(client,addr))
             thread.start()
 
@@ -0,0 +1,432 @@
+import os
+import json
+import time
+import uuid
+import base64
+import hashlib
+from collections import OrderedDict
+
+from .messageType import MESSAGE_TYPE
+
+"""
+Classes to send a large message field (e.g. model weights) as a stream of chunks and to
+reassemble it on the receiving side
+"""
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+# Seconds without a new chunk after which an incomplete incoming stream is dropped
+DEFAULT_STREAM_TIMEOUT = 600
+
+# Fields of a manifest message which are not part of the original message
+stream_fields = ['STREAM_ID', 'STREAM_TYPE', 'FIELD', 'SIZE', 'SIZES', 'CHUNK_SIZE', 'CHECKSUMS', 'KEYS', 'SNAPSHOT', 'BASE', 'ALL_KEYS', 'STREAM_ROOM']
+
+# Fields of the original message which are copied to every chunk to route it like the original
+routing_fields = ['TO_ROOM', 'TO', 'SENT_BY']
+
+
+def checksum(data):
+    """
+    Returns the checksum of the given bytes.
+
+    :param data: The data to calculate the checksum for.
+    :return: The hex encoded SHA-256 checksum.
+    :rtype: str
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def chunk_layout(sizes, chunk_size):
+    """
+    Returns the position of each chunk of a stream. Every entry of the stream is split into
+    its own chunks, so a chunk never spans two entries.
+
+    :param sizes: The encoded size of each entry in bytes.
+    :param chunk_size: The maximum size of a chunk in bytes.
+    :return: A list of (entry index, start within the entry, start within the stream, length)
+             tuples, one per chunk.
+    :rtype: list
+    """
+    layout = []
+    offset = 0
+    for entry, size in enumerate(sizes):
+        for start in range(0, max(size, 1), chunk_size):
+            layout.append((entry, start, offset + start, min(chunk_size, size - start)))
+        offset += size
+    return layout
+
+
+class StreamSender:
+    """
+    This class splits messages with a large stream field into a manifest message followed by
+    chunk messages. If the stream field is a dictionary, each entry (e.g. each tensor) is
+    encoded and chunked on its own, so apart from the message itself at most one encoded
+    entry is held in memory while a stream is sent. Entries are encoded twice, once to
+    calculate the checksums for the manifest and once to send the chunks.
+
+    :param name: The name of the sending client.
+    :param chunk_size: The size of each chunk in bytes.
+    :param format: The encoding format to use for the payload.
+    :param delta: If True and the stream field is a dictionary, only the entries which changed
+                  since the last stream to the same recipients are sent. The manifest names the
+                  snapshot the entries are based on, so receivers without it ask for a full stream.
+    :param cache_size: The number of sent streams to keep to answer resume requests. Only a
+                       reference to the streamed field is kept, so it must not be modified
+                       while it can still be resumed. Disabled by default.
+
+    :ivar snapshots: The snapshot ID and the checksum of each entry of the last sent dictionary
+                     per recipient.
+    :ivar cache: The manifests and streamed fields of the last sent streams by stream ID.
+    """
+    def __init__(self, name, chunk_size=DEFAULT_CHUNK_SIZE, format='utf-8', delta=False, cache_size=0):
+        self.name = name
+        self.chunk_size = chunk_size
+        self.format = format
+        self.delta = delta
+        self.cache_size = cache_size
+        self.snapshots = dict()
+        self.cache = OrderedDict()
+
+    def is_streamable(self, message):
+        """
+        Check if the given message has a stream field which should be sent as a stream.
+
+        :param message: The message to check.
+        :return: True if the message should be sent as a stream, False otherwise.
+        """
+        msg_type = MESSAGE_TYPE.by_id(message.get('TYPE'))
+        return msg_type is not None and msg_type.stream_field is not None and msg_type.stream_field in message
+
+    def encode(self, value):
+        """
+        Encode a single entry of a stream.
+
+        :param value: The value to encode.
+        :return: The encoded value.
+        :rtype: bytes
+        """
+        return json.dumps(value).encode(self.format)
+
+    def stream(self, message, full=False):
+        """
+        Split the given message into a manifest message and chunk messages. The chunks are
+        encoded one entry at a time while the generator is consumed.
+
+        :param message: The message to split.
+        :param full: If True, all entries are sent even if delta streaming is enabled.
+        :return: A generator yielding the manifest message followed by the chunk messages.
+        """
+        msg_type = MESSAGE_TYPE.by_id(message['TYPE'])
+        field = msg_type.stream_field
+        value = message[field]
+
+        manifest = {k: v for k, v in message.items() if k != field}
+        manifest['TYPE'] = MESSAGE_TYPE.STREAM.MANIFEST.id
+        manifest['STREAM_TYPE'] = msg_type.id
+        manifest['FIELD'] = field
+
+        keys = list(value.keys()) if isinstance(value, dict) else None
+        sizes, checksums, digests = [], [], dict()
+        for key in (keys if keys is not None else [None]):
+            data = memoryview(self.encode(value if keys is None else value[key]))
+            sizes.append(len(data))
+            digests[key] = checksum(data)
+            checksums.append([checksum(data[i:i + self.chunk_size]) for i in range(0, max(len(data), 1), self.chunk_size)])
+            del data
+
+        if self.delta and keys is not None:
+            target = (msg_type.id, message.get('TO_ROOM'), message.get('TO'))
+            previous = self.snapshots.get(target)
+            manifest['SNAPSHOT'] = checksum(json.dumps(sorted(digests.items())).encode(self.format))[:32]
+            manifest['ALL_KEYS'] = keys
+            if previous is not None and not full:
+                manifest['BASE'] = previous['ID']
+                changed = [i for i, k in enumerate(keys) if previous['DIGESTS'].get(k) != digests[k]]
+                keys = [keys[i] for i in changed]
+                sizes = [sizes[i] for i in changed]
+                checksums = [checksums[i] for i in changed]
+            self.snapshots[target] = {'ID': manifest['SNAPSHOT'], 'DIGESTS': digests}
+
+        if keys is not None:
+            manifest['KEYS'] = keys
+        manifest['SIZES'] = sizes
+        manifest['SIZE'] = sum(sizes)
+        manifest['CHUNK_SIZE'] = self.chunk_size
+        manifest['CHECKSUMS'] = [c for entry in checksums for c in entry]
+        manifest['ID'] = manifest.get('ID', uuid.uuid4().hex)
+        manifest['STREAM_ID'] = checksum(f"{self.name}:{msg_type.id}:{manifest['ID']}:{manifest.get('TO_ROOM')}:{manifest.get('TO')}:{manifest.get('BASE')}:{''.join(manifest['CHECKSUMS'])}".encode(self.format))[:32]
+
+        if self.cache_size > 0:
+            self.cache[manifest['STREAM_ID']] = (manifest, value)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+        yield manifest
+        yield from self.chunks(manifest, value)
+
+    def chunks(self, manifest, value, indices=None):
+        """
+        Create the chunk messages for the given manifest and streamed field.
+
+        :param manifest: The manifest message of the stream.
+        :param value: The streamed field.
+        :param indices: The indices of the chunks to create. If not specified, all chunks are created.
+        :return: A generator yielding the chunk messages.
+        """
+        layout = chunk_layout(manifest['SIZES'], manifest['CHUNK_SIZE'])
+        indices = set(range(len(layout))) if indices is None else set(indices)
+        keys = manifest.get('KEYS')
+        data, data_entry = None, None
+        for index, (entry, start, offset, length) in enumerate(layout):
+            if index not in indices:
+                continue
+            if data_entry != entry:
+                data = memoryview(self.encode(value if keys is None else value[keys[entry]]))
+                data_entry = entry
+            chunk = {
+                'ID': uuid.uuid4().hex,
+                'TYPE': MESSAGE_TYPE.STREAM.CHUNK.id,
+                'STREAM_ID': manifest['STREAM_ID'],
+                'INDEX': index,
+                'CHUNK': base64.b64encode(data[start:start + length]).decode('ascii'),
+            }
+            for field in routing_fields:
+                if field in manifest:
+                    chunk[field] = manifest[field]
+            yield chunk
+
+    def resume(self, message):
+        """
+        Create the messages requested by the given resume message. The messages are sent
+        directly to the requesting client and name the original room in STREAM_ROOM. If a full stream is
+        requested, the sender forgets the snapshot the receiver is missing, so the next stream
+        to the same recipients contains all entries.
+
+        :param message: The resume message containing the stream ID and the missing chunk
+                        indices, or the FULL flag.
+        :return: A generator yielding the requested messages, or nothing if the stream is no
+                 longer cached.
+        """
+        if message.get('FULL', False):
+            for target in [t for t, s in self.snapshots.items() if s['ID'] == message.get('SNAPSHOT')]:
+                del self.snapshots[target]
+        if message['STREAM_ID'] not in self.cache:
+            print(f"[STREAM] Can't resume {message['STREAM_ID']}, stream is not cached.")
+            return
+        manifest, value = self.cache[message['STREAM_ID']]
+        if 'SENT_BY' in message:
+            manifest = {k: v for k, v in manifest.items() if k != 'TO_ROOM'}
+            manifest['TO'] = message['SENT_BY']
+            if 'TO_ROOM' in self.cache[message['STREAM_ID']][0]:
+                manifest['STREAM_ROOM'] = self.cache[message['STREAM_ID']][0]['TO_ROOM']
+        if message.get('FULL', False):
+            original = {k: v for k, v in manifest.items() if k not in stream_fields or k == 'STREAM_ROOM'}
+            original['TYPE'] = manifest['STREAM_TYPE']
+            original[manifest['FIELD']] = value
+            yield from self.stream(original, full=True)
+        else:
+            yield from self.chunks(manifest, value, message['MISSING'])
+
+
+class StreamReceiver:
+    """
+    This class reassembles streamed messages from their manifest and chunk messages. Chunks are
+    written into a preallocated buffer as they arrive, either in memory or, if a stream
+    directory is given, in a file. Chunks which have already been received are skipped, which
+    allows an interrupted transfer to be resumed. For delta streams the last received
+    dictionary of each sender is kept in memory as the base of the next stream. Incomplete
+    streams which haven't received a chunk within the timeout are dropped with their buffer.
+
+    :param format: The encoding format used for the payload.
+    :param stream_dir: A directory to write incoming streams to. If not specified, streams are
+                       assembled in memory. Partially received streams in this directory are
+                       picked up again after a restart.
+    :param timeout: The number of seconds after the last received chunk after which an
+                    incomplete stream is dropped, or None to keep incomplete streams.
+
+    :ivar streams: The state of the incomplete streams by stream ID.
+    :ivar snapshots: The received dictionaries of delta streams by snapshot ID.
+    :ivar latest: The ID of the last received snapshot per sender, stream type and room.
+    """
+    def __init__(self, format='utf-8', stream_dir=None, timeout=DEFAULT_STREAM_TIMEOUT):
+        self.format = format
+        self.stream_dir = stream_dir
+        self.timeout = timeout
+        self.streams = dict()
+        self.snapshots = dict()
+        self.latest = dict()
+        if self.stream_dir is not None:
+            os.makedirs(self.stream_dir, exist_ok=True)
+            for file in os.listdir(self.stream_dir):
+                if file.endswith('.manifest'):
+                    with open(os.path.join(self.stream_dir, file), encoding=self.format) as f:
+                        manifest = json.load(f)
+                    if not self.add_manifest(manifest):
+                        self.remove_files(manifest['STREAM_ID'])
+
+    def path(self, stream_id, extension):
+        """
+        Returns the path of the file with the given extension for the given stream.
+        """
+        return os.path.join(self.stream_dir, f"{stream_id}.{extension}")
+
+    def remove_files(self, stream_id):
+        """
+        Removes the files of the given stream from the stream directory.
+        """
+        for extension in ['part', 'manifest']:
+            if os.path.exists(self.path(stream_id, extension)):
+                os.remove(self.path(stream_id, extension))
+
+    def drop(self, stream_id):
+        """
+        Stop receiving the given stream and release its buffer and files.
+
+        :param stream_id: The ID of the stream.
+        """
+        state = self.streams.pop(stream_id, None)
+        if state is None:
+            return
+        if self.stream_dir is not None:
+            state['buffer'].close()
+            self.remove_files(stream_id)
+
+    def drop_expired(self):
+        """
+        Drop the incomplete streams which haven't received a chunk within the timeout.
+        """
+        if self.timeout is None:
+            return
+        now = time.monotonic()
+        for stream_id in [k for k, v in self.streams.items() if now - v['updated'] > self.timeout]:
+            print(f"[STREAM] Dropped {stream_id}, no chunk received for {self.timeout} seconds.")
+            self.drop(stream_id)
+
+    def add_manifest(self, manifest):
+        """
+        Start receiving the stream described by the given manifest. If parts of the stream have
+        already been received, they are kept. A delta stream is rejected if the snapshot it is
+        based on hasn't been received.
+
+        :param manifest: The manifest message of the stream.
+        :return: False if the stream is rejected, True otherwise.
+        :rtype: bool
+        """
+        self.drop_expired()
+        stream_id = manifest['STREAM_ID']
+        if stream_id in self.streams:
+            return True
+        if 'BASE' in manifest and manifest['BASE'] not in self.snapshots:
+            print(f"[STREAM] Rejected {stream_id}, base snapshot {manifest['BASE']} is unknown.")
+            return False
+        state = {'manifest': manifest, 'received': set(), 'base': self.snapshots.get(manifest.get('BASE')), 'updated': time.monotonic()}
+        layout = chunk_layout(manifest['SIZES'], manifest['CHUNK_SIZE'])
+        if self.stream_dir is None:
+            state['buffer'] = bytearray(manifest['SIZE'])
+        else:
+            with open(self.path(stream_id, 'manifest'), 'w', encoding=self.format) as f:
+                json.dump(manifest, f)
+            mode = 'r+b' if os.path.exists(self.path(stream_id, 'part')) else 'w+b'
+            state['buffer'] = open(self.path(stream_id, 'part'), mode)
+            state['buffer'].truncate(manifest['SIZE'])
+            for index, (entry, start, offset, length) in enumerate(layout):
+                state['buffer'].seek(offset)
+                if checksum(state['buffer'].read(length)) == manifest['CHECKSUMS'][index]:
+                    state['received'].add(index)
+        state['layout'] = layout
+        self.streams[stream_id] = state
+        return True
+
+    def add_chunk(self, chunk):
+        """
+        Add the given chunk to its stream. Chunks with an index outside of the stream are dropped.
+
+        :param chunk: The chunk message.
+        :return: The reassembled original message if the stream is complete, None otherwise.
+        """
+        self.drop_expired()
+        state = self.streams.get(chunk['STREAM_ID'])
+        if state is None:
+            return None
+        manifest = state['manifest']
+        if type(chunk['INDEX']) is not int or not 0 <= chunk['INDEX'] < len(manifest['CHECKSUMS']):
+            print(f"[STREAM] Chunk {chunk['INDEX']} of {chunk['STREAM_ID']} is out of range.")
+            return None
+        if chunk['INDEX'] in state['received']:
+            return None
+        data = base64.b64decode(chunk['CHUNK'])
+        if checksum(data) != manifest['CHECKSUMS'][chunk['INDEX']]:
+            print(f"[STREAM] Chunk {chunk['INDEX']} of {chunk['STREAM_ID']} has an invalid checksum.")
+            return None
+        offset = state['layout'][chunk['INDEX']][2]
+        if self.stream_dir is None:
+            state['buffer'][offset:offset + len(data)] = data
+        else:
+            state['buffer'].seek(offset)
+            state['buffer'].write(data)
+        state['received'].add(chunk['INDEX'])
+        state['updated'] = time.monotonic()
+        if len(state['received']) == len(manifest['CHECKSUMS']):
+            return self.complete(chunk['STREAM_ID'])
+        return None
+
+    def missing(self, stream_id):
+        """
+        Returns the indices of the chunks of the given stream which have not been received yet.
+
+        :param stream_id: The ID of the stream.
+        :return: The list of missing chunk indices.
+        """
+        state = self.streams[stream_id]
+        return [i for i in range(len(state['manifest']['CHECKSUMS'])) if i not in state['received']]
+
+    def complete(self, stream_id):
+        """
+        Reassemble the original message of the given completed stream and release its buffer.
+
+        :param stream_id: The ID of the stream.
+        :return: The reassembled original message.
+        """
+        state = self.streams.pop(stream_id)
+        manifest = state['manifest']
+        values = []
+        offset = 0
+        for size in manifest['SIZES']:
+            if self.stream_dir is None:
+                data = bytes(state['buffer'][offset:offset + size])
+            else:
+                state['buffer'].seek(offset)
+                data = state['buffer'].read(size)
+            values.append(json.loads(data.decode(self.format)))
+            offset += size
+        if self.stream_dir is not None:
+            state['buffer'].close()
+            self.remove_files(stream_id)
+
+        value = dict(zip(manifest['KEYS'], values)) if 'KEYS' in manifest else values[0]
+        if 'SNAPSHOT' in manifest:
+            if state['base'] is not None:
+                value = {k: value[k] if k in value else state['base'][k] for k in manifest['ALL_KEYS']}
+            self.store_snapshot(manifest, value)
+
+        message = {k: v for k, v in manifest.items() if k not in stream_fields}
+        if 'STREAM_ROOM' in manifest:
+            message.pop('TO', None)
+            message['TO_ROOM'] = manifest['STREAM_ROOM']
+        message['TYPE'] = manifest['STREAM_TYPE']
+        message[manifest['FIELD']] = value
+        return message
+
+    def store_snapshot(self, manifest, value):
+        """
+        Keep the given dictionary as the base for the next delta stream of its sender. The
+        previous snapshot of the same sender, stream type and room is released.
+
+        :param manifest: The manifest message of the stream.
+        :param value: The reassembled dictionary.
+        """
+        key = (manifest.get('SENT_BY'), manifest['STREAM_TYPE'], manifest.get('STREAM_ROOM', manifest.get('TO_ROOM')))
+        previous = self.latest.get(key)
+        self.latest[key] = manifest['SNAPSHOT']
+        self.snapshots[manifest['SNAPSHOT']] = value
+        if previous is not None and previous != manifest['SNAPSHOT'] and previous not in self.latest.values():
+            del self.snapshots[previous]
@@ -0,0 +1,73 @@
+from swergio import MESSAGE_TYPE
+from swergio.aggregation import AggregationRoom, reduce_values, reduce_operations, same_shape
+
+
+def gradient(sender, data, root_id='step'):
+    return {'ID': sender, 'TYPE': MESSAGE_TYPE.DATA.GRADIENT.id, 'DATA': data, 'ROOT_ID': root_id, 'SENT_BY': sender, 'TO_ROOM': 'grad'}
+
+
+def test_reduce_values_nested():
+    values = [{'a': [1, 2], 'b': 3}, {'a': [3, 4], 'b': 5}]
+    assert reduce_values(values, reduce_operations['sum']) == {'a': [4, 6], 'b': 8}
+    assert reduce_values(values, reduce_operations['mean']) == {'a': [2.0, 3.0], 'b': 4.0}
+    assert reduce_values(values, reduce_operations['max']) == {'a': [3, 4], 'b': 5}
+
+
+def test_same_shape():
+    assert same_shape({'a': [1, 2.5]}, {'a': [3, 4]})
+    assert not same_shape({'a': [1, 2]}, {'b': [1, 2]})
+    assert not same_shape([1, 2], [1, 2, 3])
+    assert not same_shape(['x'], ['y'])
+    assert not same_shape([True], [False])
+
+
+def test_aggregation_room_reduces_group():
+    room = AggregationRoom('grad', 2, callback=None)
+    assert room.add(gradient('w0', [1, 2])) is None
+    reduced = room.add(gradient('w1', [3, 4]))
+    assert reduced['DATA'] == [4, 6]
+    assert reduced['SENT_BY'] == 'grad'
+    assert reduced['CONTRIBUTORS'] == ['w0', 'w1']
+    assert room.groups == {}
+
+
+def test_aggregation_room_drops_mismatched_contribution():
+    room = AggregationRoom('grad', 2, callback=None)
+    room.add(gradient('w0', {'a': [1, 2]}))
+    assert room.add(gradient('w1', {'b': [1, 2]})) is None
+    assert room.add(gradient('w2', {'a': [1]})) is None
+    assert room.add(gradient('w3', {'a': [3, 4]}))['DATA'] == {'a': [4, 6]}
+
+
+def test_aggregation_room_deduplicates_sender():
+    room = AggregationRoom('grad', 2, callback=None)
+    room.add(gradient('w0', [1]))
+    assert room.add(gradient('w0', [5])) is None
+    assert room.add(gradient('w1', [1]))['DATA'] == [6]
+
+
+def test_aggregation_room_timeout():
+    reduced = []
+    room = AggregationRoom('grad', 3, callback=lambda room, msg_content: reduced.append(msg_content), timeout=60)
+    room.add(gradient('w0', [1]))
+    room.expire('step')
+    assert reduced[0]['DATA'] == [1]
+    assert reduced[0]['CONTRIBUTORS'] == ['w0']
+
+
+def test_aggregation_room_drops_late_contribution():
+    reduced = []
+    room = AggregationRoom('grad', 2, callback=lambda room, msg_content: reduced.append(msg_content), timeout=60)
+    room.add(gradient('w0', [1]))
+    room.expire('step')
+    assert room.add(gradient('w1', [5])) is None
+    assert room.groups == {}
+    assert [m['DATA'] for m in reduced] == [[1]]
+
+
+def test_aggregation_room_forgets_old_groups():
+    room = AggregationRoom('grad', 1, callback=None, completed_size=2)
+    for step in ['s0', 's1', 's2']:
+        room.add(gradient('w0', [1], step))
+    assert list(room.completed) == ['s1', 's2']
+    assert room.add(gradient('w0', [1], 's0'))['DATA'] == [1]
@@ -0,0 +1,101 @@
+import threading
+
+from swergio import MESSAGE_TYPE, PRIORITY
+from swergio.lanes import PriorityLanes
+
+
+def drain(lanes):
+    lanes.close()
+    items = []
+    item = lanes.get()
+    while item is not None:
+        items.append(item)
+        item = lanes.get()
+    return items
+
+
+def test_priority_lanes_serve_higher_priority_first():
+    lanes = PriorityLanes()
+    lanes.put('data', PRIORITY.NORMAL)
+    lanes.put('log', PRIORITY.LOW)
+    lanes.put('command', PRIORITY.HIGH)
+    assert drain(lanes) == ['command', 'data', 'log']
+
+
+def test_priority_lanes_starvation_order():
+    lanes = PriorityLanes(starvation_limit=2)
+    for i in range(5):
+        lanes.put(('data', i), PRIORITY.NORMAL)
+    for i in range(5):
+        lanes.put(('command', i), PRIORITY.HIGH)
+    assert drain(lanes) == [
+        ('command', 0), ('command', 1), ('data', 0),
+        ('command', 2), ('command', 3), ('data', 1),
+        ('command', 4), ('data', 2), ('data', 3), ('data', 4),
+    ]
+
+
+def test_priority_lanes_size_limit_blocks_lower_lanes():
+    lanes = PriorityLanes(max_size=2)
+    lanes.put('data', PRIORITY.NORMAL)
+    lanes.put('data', PRIORITY.NORMAL)
+    lanes.put('command', PRIORITY.HIGH)
+    assert lanes.size == 3
+
+    added = threading.Event()
+    producer = threading.Thread(target=lambda: lanes.put('log', PRIORITY.LOW) and added.set())
+    producer.start()
+    assert not added.wait(0.1)
+    assert lanes.get() == 'command'
+    assert lanes.get() == 'data'
+    assert added.wait(1)
+    producer.join()
+
+
+def test_priority_lanes_size_limit_blocks_high_lane():
+    lanes = PriorityLanes(max_size=2, high_max_size=3)
+    for _ in range(3):
+        lanes.put('command', PRIORITY.HIGH)
+
+    added = threading.Event()
+    producer = threading.Thread(target=lambda: lanes.put('command', PRIORITY.HIGH) and added.set())
+    producer.start()
+    assert not added.wait(0.1)
+    assert lanes.get() == 'command'
+    assert added.wait(1)
+    producer.join()
+    assert lanes.size == 3
+
+
+def test_priority_lanes_accept_oversized_item_when_empty():
+    lanes = PriorityLanes(max_size=10)
+    assert lanes.put('weights', PRIORITY.LOW, size=100)
+    assert lanes.get() == 'weights'
+
+
+def test_priority_lanes_drop_after_close():
+    lanes = PriorityLanes(max_size=1)
+    lanes.put('data', PRIORITY.NORMAL)
+    lanes.close()
+    assert not lanes.put('data', PRIORITY.NORMAL)
+
+
+def test_message_priority():
+    assert MESSAGE_TYPE.priority({'TYPE': MESSAGE_TYPE.COMMAND.JOINROOM.id}) == PRIORITY.HIGH
+    assert MESSAGE_TYPE.priority({'TYPE': MESSAGE_TYPE.DATA.FORWARD.id}) == PRIORITY.NORMAL
+    assert MESSAGE_TYPE.priority({'TYPE': MESSAGE_TYPE.COMMAND.LOADMODELWEIGHTS.id}) == PRIORITY.NORMAL
+    assert MESSAGE_TYPE.priority({'TYPE': MESSAGE_TYPE.COMMAND.SAVESETTINGS.id}) == PRIORITY.NORMAL
+    assert MESSAGE_TYPE.priority({'TYPE': MESSAGE_TYPE.STREAM.CHUNK.id}) == PRIORITY.LOW
+    assert MESSAGE_TYPE.priority({'TYPE': MESSAGE_TYPE.DATA.FORWARD.id, 'PRIORITY': PRIORITY.HIGH}) == PRIORITY.HIGH
+
+
+def test_message_priority_ignores_invalid_values():
+    for priority in [7, -1, 'HIGH', True, None, 1.0]:
+        assert MESSAGE_TYPE.priority({'TYPE': MESSAGE_TYPE.DATA.FORWARD.id, 'PRIORITY': priority}) == PRIORITY.NORMAL
+
+
+def test_priority_lanes_put_unknown_priority():
+    lanes = PriorityLanes()
+    lanes.put('low', PRIORITY.LOW)
+    lanes.put('unknown', 5)
+    assert drain(lanes) == ['unknown', 'low']
@@ -0,0 +1,91 @@
+import pytest
+
+from swergio import MESSAGE_TYPE, LoopbackBus, LoopbackClient, Trigger
+
+
+def run_pipeline():
+    """
+    Run a forward pass through two components and aggregate their gradients on the bus.
+    """
+    bus = LoopbackBus(enable_logging=False)
+    bus.server.add_aggregation_room('grad', 2)
+    calls = []
+    source = LoopbackClient('source', bus)
+    model = LoopbackClient('model', bus)
+    loss = LoopbackClient('loss', bus)
+    critic = LoopbackClient('critic', bus)
+
+    def forward(message):
+        calls.append(('model', message['DATA']))
+        return {'DATA': [x * 2 for x in message['DATA']]}
+
+    def backward(message):
+        calls.append(('loss', message['DATA']))
+        return {'DATA': [1 for _ in message['DATA']]}
+
+    def gradient(message):
+        calls.append(('critic', message['DATA']))
+        return {'DATA': [x * 3 for x in message['DATA']]}
+
+    model.add_eventHandler(forward, MESSAGE_TYPE.DATA.FORWARD, 'out', trigger=Trigger(MESSAGE_TYPE.DATA.FORWARD, 'in'))
+    loss.add_eventHandler(backward, MESSAGE_TYPE.DATA.GRADIENT, 'grad', trigger=Trigger(MESSAGE_TYPE.DATA.FORWARD, 'out'))
+    critic.add_eventHandler(gradient, MESSAGE_TYPE.DATA.GRADIENT, 'grad', trigger=Trigger(MESSAGE_TYPE.DATA.FORWARD, 'out'))
+    source.add_eventHandler(lambda message: calls.append(('source', message['DATA'], message['CONTRIBUTORS'])), None, trigger=Trigger(MESSAGE_TYPE.DATA.GRADIENT, 'grad'))
+
+    source.send({'ID': 'x', 'TYPE': MESSAGE_TYPE.DATA.FORWARD.id, 'DATA': [1, 2], 'TO_ROOM': 'in', 'ROOT_ID': 'step'})
+    source.listen()
+    return calls
+
+
+def test_loopback_round_trip_is_deterministic():
+    calls = run_pipeline()
+    assert calls[0] == ('model', [1, 2])
+    assert calls[1:3] == [('loss', [2, 4]), ('critic', [2, 4])]
+    assert calls[-1] == ('source', [7, 13], ['loss', 'critic'])
+    assert all(run_pipeline() == calls for _ in range(3))
+
+
+def test_loopback_isolates_clients():
+    bus = LoopbackBus(enable_logging=False)
+    seen = []
+
+    def mutate(message):
+        message['DATA'].append('mut')
+        seen.append(list(message['DATA']))
+
+    sender = LoopbackClient('sender', bus)
+    for name in ['a', 'b']:
+        LoopbackClient(name, bus).add_eventHandler(mutate, None, trigger=Trigger(MESSAGE_TYPE.DATA.FORWARD, 'room'))
+    data = [1, 2]
+    sender.send({'ID': 'x', 'TYPE': MESSAGE_TYPE.DATA.FORWARD.id, 'DATA': data, 'TO_ROOM': 'room'})
+    bus.run()
+    assert seen == [[1, 2, 'mut'], [1, 2, 'mut']]
+    assert data == [1, 2]
+
+
+def test_loopback_server_cannot_start():
+    with pytest.raises(RuntimeError):
+        LoopbackBus(enable_logging=False).server.start()
+
+
+def test_loopback_aggregation_timeout_is_deterministic():
+    bus = LoopbackBus(enable_logging=False)
+    bus.server.add_aggregation_room('grad', 2, timeout=1)
+    received = []
+    worker = LoopbackClient('worker', bus)
+    LoopbackClient('source', bus).add_eventHandler(lambda message: received.append((message['ROOT_ID'], message['DATA'])), None, trigger=Trigger(MESSAGE_TYPE.DATA.GRADIENT, 'grad'))
+    LoopbackClient('other', bus).add_eventHandler(lambda message: None, None, trigger=Trigger(MESSAGE_TYPE.DATA.FORWARD, 'in'))
+
+    bus.run()
+
+    worker.send({'ID': 'a', 'TYPE': MESSAGE_TYPE.DATA.GRADIENT.id, 'DATA': [1], 'TO_ROOM': 'grad', 'ROOT_ID': 'first'})
+    assert bus.server.aggregation_rooms['grad'].groups['first']['timer'] is None
+    worker.send({'ID': 'b', 'TYPE': MESSAGE_TYPE.DATA.FORWARD.id, 'DATA': [0], 'TO_ROOM': 'in'})
+    assert bus.run(max_steps=1) == 1
+    assert received == []
+    bus.run(max_steps=1)
+    assert received == [('first', [1])]
+
+    worker.send({'ID': 'c', 'TYPE': MESSAGE_TYPE.DATA.GRADIENT.id, 'DATA': [2], 'TO_ROOM': 'grad', 'ROOT_ID': 'second'})
+    bus.run()
+    assert received == [('first', [1]), ('second', [2])]
@@ -0,0 +1,135 @@
+from swergio import MESSAGE_TYPE
+from swergio.stream import StreamSender, StreamReceiver
+
+
+def weights_message(weights, room='weights'):
+    return {'ID': 'msg', 'TYPE': MESSAGE_TYPE.COMMAND.LOADMODELWEIGHTS.id, 'WEIGHTS': weights, 'TO_ROOM': room}
+
+
+def deliver(messages, receiver, sent_by='sender'):
+    """
+    Pass the given stream messages to the receiver and return the reassembled messages.
+    """
+    completed = []
+    for message in messages:
+        message = dict(message, SENT_BY=sent_by)
+        if message['TYPE'] == MESSAGE_TYPE.STREAM.MANIFEST.id:
+            assert receiver.add_manifest(message)
+            if not receiver.missing(message['STREAM_ID']):
+                completed.append(receiver.complete(message['STREAM_ID']))
+        else:
+            result = receiver.add_chunk(message)
+            if result is not None:
+                completed.append(result)
+    return completed
+
+
+def test_stream_roundtrip():
+    weights = {'w1': list(range(500)), 'w2': [0.5] * 100}
+    sender = StreamSender('sender', chunk_size=64)
+    messages = list(sender.stream(weights_message(weights)))
+
+    assert messages[0]['TYPE'] == MESSAGE_TYPE.STREAM.MANIFEST.id
+    assert len(messages) == len(messages[0]['CHECKSUMS']) + 1
+    completed = deliver(messages, StreamReceiver())
+    assert len(completed) == 1
+    assert completed[0]['TYPE'] == MESSAGE_TYPE.COMMAND.LOADMODELWEIGHTS.id
+    assert completed[0]['WEIGHTS'] == weights
+    assert completed[0]['TO_ROOM'] == 'weights'
+
+
+def test_stream_resume_from_partial_file(tmp_path):
+    weights = {'w1': list(range(500)), 'w2': [0.5] * 100}
+    messages = list(StreamSender('sender', chunk_size=64).stream(weights_message(weights)))
+    manifest, chunks = messages[0], messages[1:]
+
+    receiver = StreamReceiver(stream_dir=str(tmp_path))
+    deliver([manifest] + chunks[:5], receiver)
+    receiver.streams[manifest['STREAM_ID']]['buffer'].close()
+
+    restarted = StreamReceiver(stream_dir=str(tmp_path))
+    assert restarted.missing(manifest['STREAM_ID']) == list(range(5, len(chunks)))
+    completed = deliver(chunks[5:], restarted)
+    assert completed[0]['WEIGHTS'] == weights
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_stream_resume_missing_chunks_from_cache():
+    weights = {'w1': list(range(500))}
+    sender = StreamSender('sender', chunk_size=64, cache_size=1)
+    messages = list(sender.stream(weights_message(weights)))
+    receiver = StreamReceiver()
+    deliver(messages[:3], receiver)
+
+    stream_id = messages[0]['STREAM_ID']
+    resume = {'STREAM_ID': stream_id, 'MISSING': receiver.missing(stream_id), 'SENT_BY': 'receiver'}
+    resent = list(sender.resume(resume))
+    assert all(chunk['TO'] == 'receiver' and 'TO_ROOM' not in chunk for chunk in resent)
+    completed = deliver(resent, receiver)[0]
+    assert completed['WEIGHTS'] == weights
+    assert completed['TO_ROOM'] == 'weights'
+
+
+def test_stream_delta_sends_changed_entries():
+    sender = StreamSender('sender', chunk_size=64, delta=True)
+    receiver = StreamReceiver()
+    first = {'w1': [1, 2, 3], 'w2': [4, 5, 6]}
+    deliver(sender.stream(weights_message(first)), receiver)
+
+    second = {'w1': [9, 9, 9], 'w2': [4, 5, 6]}
+    messages = list(sender.stream(weights_message(second)))
+    assert messages[0]['KEYS'] == ['w1']
+    assert deliver(messages, receiver)[0]['WEIGHTS'] == second
+
+
+def test_stream_delta_rejected_without_base():
+    sender = StreamSender('sender', chunk_size=64, delta=True, cache_size=1)
+    list(sender.stream(weights_message({'w1': [1, 2, 3], 'w2': [4, 5, 6]})))
+    second = {'w1': [9, 9, 9], 'w2': [4, 5, 6]}
+    manifest = next(sender.stream(weights_message(second)))
+
+    receiver = StreamReceiver()
+    assert not receiver.add_manifest(dict(manifest, SENT_BY='sender'))
+
+    resume = {'STREAM_ID': manifest['STREAM_ID'], 'MISSING': [], 'FULL': True, 'SNAPSHOT': manifest['SNAPSHOT'], 'SENT_BY': 'receiver'}
+    resent = list(sender.resume(resume))
+    assert 'BASE' not in resent[0]
+    assert resent[0]['TO'] == 'receiver' and resent[0]['STREAM_ROOM'] == 'weights'
+    completed = deliver(resent, receiver)[0]
+    assert completed['WEIGHTS'] == second
+    assert completed['TO_ROOM'] == 'weights' and 'TO' not in completed
+    assert 'BASE' not in next(sender.stream(weights_message(second)))
+
+
+def test_stream_ids_differ_per_type():
+    weights = {'w1': list(range(500))}
+    sender = StreamSender('sender', chunk_size=64, cache_size=2)
+    load = list(sender.stream(weights_message(weights)))
+    save = list(sender.stream(dict(weights_message(weights), TYPE=MESSAGE_TYPE.COMMAND.SAVEMODELWEIGHTS.id)))
+    assert load[0]['STREAM_ID'] != save[0]['STREAM_ID']
+    assert len(sender.cache) == 2
+
+    receiver = StreamReceiver()
+    deliver(load[:3], receiver)
+    completed = deliver(save, receiver)
+    assert completed[0]['TYPE'] == MESSAGE_TYPE.COMMAND.SAVEMODELWEIGHTS.id
+    assert completed[0]['WEIGHTS'] == weights
+
+
+def test_stream_drops_invalid_chunk_index():
+    messages = list(StreamSender('sender', chunk_size=64).stream(weights_message({'w1': list(range(500))})))
+    receiver = StreamReceiver()
+    deliver(messages[:1], receiver)
+    for index in [-1, len(messages) - 1, '0', None]:
+        assert receiver.add_chunk(dict(messages[1], INDEX=index)) is None
+    assert receiver.missing(messages[0]['STREAM_ID']) == list(range(len(messages) - 1))
+
+
+def test_stream_drops_abandoned_stream(tmp_path):
+    messages = list(StreamSender('sender', chunk_size=64).stream(weights_message({'w1': list(range(500))})))
+    receiver = StreamReceiver(stream_dir=str(tmp_path), timeout=60)
+    deliver(messages[:3], receiver)
+    receiver.streams[messages[0]['STREAM_ID']]['updated'] -= 120
+    receiver.drop_expired()
+    assert receiver.streams == {}
+    assert list(tmp_path.iterdir()) == []